@@ -1,23 +1,23 @@
 # app.py
 import os
-import json
+import gzip
 import base64
 import hmac
 import hashlib
 import tempfile
-import shutil
 import logging
 import threading
-import time
-import subprocess
 import sys
 import shlex
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Any, Dict
 
-import requests
-from fastapi import FastAPI, Request, HTTPException
+import asyncio
+
+import httpx
+import orjson
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
 from fastapi.responses import PlainTextResponse, JSONResponse
 
 # ---- Logging ----
@@ -30,8 +30,16 @@ ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "0"))
 VIP_CHANNEL_ID = int(os.getenv("VIP_CHANNEL_ID", "0"))
 DARK_CHANNEL_ID = int(os.getenv("DARK_CHANNEL_ID", "0"))
 RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET", "")
+# encoded once at import so the hot webhook path never re-encodes the secret
+_RAZORPAY_SECRET_BYTES = RAZORPAY_WEBHOOK_SECRET.encode("utf-8")
+# pre-keyed HMAC prototype: key expansion (inner/outer pads) happens once at
+# import; each request just copies the keyed state and feeds it the body
+_HMAC_PROTO = hmac.new(_RAZORPAY_SECRET_BYTES, digestmod=hashlib.sha256) if RAZORPAY_WEBHOOK_SECRET else None
+# snapshots are gzip-compressed (shared format with bot.py); the plain path
+# is still read once when migrating from older deployments
 DATA_DIR = os.getenv("DATA_DIR", "/data")
-DATA_FILE = os.path.join(DATA_DIR, "paymentbot.json")
+DATA_FILE = os.path.join(DATA_DIR, "paymentbot.json.gz")
+_LEGACY_DATA_FILE = os.path.join(DATA_DIR, "paymentbot.json")
 
 # payment info defaults (can override via /set_x commands in your bot)
 UPI_ID = os.getenv("UPI_ID", "")
@@ -43,29 +51,47 @@ REMITLY_INFO = os.getenv("REMITLY_INFO", "")
 # timezone
 IST = timezone(timedelta(hours=5, minutes=30))
 
+# membership tests on the webhook path: one hash lookup instead of
+# rebuilding a tuple per request
+_ACCEPTED_EVENTS = frozenset({"payment.captured", "payment.authorized", "payment.link.paid", "payment.paid"})
+_PLANS_VIP = frozenset({"vip", "both"})
+_PLANS_DARK = frozenset({"dark", "both"})
+
 # runtime state
 PENDING_PAYMENTS: Dict[str, Dict[str, Any]] = {}
-PURCHASE_LOG: list = []
+# purchase log is stored column-wise (struct-of-arrays): appending a purchase
+# is a handful of list appends, and serialization emits the column lists
+# as-is instead of walking every row. Columns cover the fields written by
+# both this service and bot.py; absent fields are None.
+_PLOG_COLUMNS = ("time", "razorpay_event", "user_id", "username", "plan", "method", "amount", "currency", "notes")
+PURCHASE_LOG: Dict[str, list] = {c: [] for c in _PLOG_COLUMNS}
 KNOWN_USERS: set = set()
 SENT_INVITES: dict = {}
 CONFIG: dict = {}
 
+# set when in-memory state has mutated; the autosave loop persists at most
+# one snapshot per interval instead of a full rewrite per webhook
+_DIRTY = threading.Event()
+
 def now_ist() -> datetime:
     return datetime.now(IST)
 
+def _purchase_append(**fields):
+    for c in _PLOG_COLUMNS:
+        PURCHASE_LOG[c].append(fields.get(c))
+
 # persistence helpers
 def _ensure_data_dir():
     Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
 
 def _serialize_state():
+    # purchase_log is already columnar with ISO timestamp strings, so it is
+    # emitted as column-list references rather than a per-row walk.
     return {
         "pending_payments": PENDING_PAYMENTS,
-        "purchase_log": [
-            {**{k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in p.items()}}
-            for p in PURCHASE_LOG
-        ],
+        "purchase_log": PURCHASE_LOG,
         "known_users": list(KNOWN_USERS),
-        "sent_invites": {str(k): v for k, v in SENT_INVITES.items()},
+        "sent_invites": SENT_INVITES,
         "config": CONFIG,
     }
 
@@ -74,25 +100,24 @@ def _deserialize_state(data):
     if not data:
         return
     PENDING_PAYMENTS = data.get("pending_payments", {}) or {}
-    PURCHASE_LOG = []
-    for p in data.get("purchase_log", []) or []:
-        pc = dict(p)
-        t = pc.get("time")
-        if isinstance(t, str):
-            try:
-                pc["time"] = datetime.fromisoformat(t)
-            except Exception:
-                pass
-        PURCHASE_LOG.append(pc)
+    raw_log = data.get("purchase_log", []) or []
+    PURCHASE_LOG = {c: [] for c in _PLOG_COLUMNS}
+    if isinstance(raw_log, dict):
+        # columnar snapshot: take the column lists directly, padding any
+        # short/missing columns so all stay the same length
+        n = max((len(v) for v in raw_log.values()), default=0)
+        for c in _PLOG_COLUMNS:
+            col = list(raw_log.get(c) or [])
+            col.extend([None] * (n - len(col)))
+            PURCHASE_LOG[c] = col
+    else:
+        # legacy row-oriented snapshot: expand once at load
+        for p in raw_log:
+            _purchase_append(**p)
     KNOWN_USERS = set(data.get("known_users", []) or [])
-    sent = data.get("sent_invites", {}) or {}
-    new_sent = {}
-    for k, v in sent.items():
-        try:
-            new_sent[int(k)] = v
-        except Exception:
-            new_sent[k] = v
-    SENT_INVITES = new_sent
+    # keys are stored as str(user_id) everywhere (JSON forces string keys
+    # anyway), so no per-load or per-save key rewrite is needed
+    SENT_INVITES = data.get("sent_invites", {}) or {}
     CONFIG = data.get("config", {}) or {}
 
 def save_state():
@@ -100,31 +125,40 @@ def save_state():
         _ensure_data_dir()
         payload = _serialize_state()
         fd, tmp = tempfile.mkstemp(dir=DATA_DIR)
-        with os.fdopen(fd, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-        shutil.move(tmp, DATA_FILE)
+        with os.fdopen(fd, "wb", buffering=1 << 20) as f:
+            # compresslevel=3: most of the ratio at a fraction of the CPU cost
+            f.write(gzip.compress(orjson.dumps(payload, option=orjson.OPT_INDENT_2), compresslevel=3))
+        os.replace(tmp, DATA_FILE)
         logger.info("Saved state to %s", DATA_FILE)
     except Exception as e:
         logger.exception("Save failed: %s", e)
 
 def load_state():
     try:
-        if not os.path.exists(DATA_FILE):
+        path = DATA_FILE if os.path.exists(DATA_FILE) else _LEGACY_DATA_FILE
+        if not os.path.exists(path):
             logger.info("No data file found - starting fresh")
             return
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(path, "rb") as f:
+            blob = f.read()
+        if blob[:2] == b"\x1f\x8b":
+            blob = gzip.decompress(blob)
+        data = orjson.loads(blob)
         _deserialize_state(data)
-        logger.info("Loaded state from %s", DATA_FILE)
+        logger.info("Loaded state from %s", path)
     except Exception as e:
         logger.exception("Load failed: %s", e)
 
 # Telegram HTTP API helper (safe from webhook context)
-def tg_api(method: str, data: dict):
+# One async HTTP/2 client for api.telegram.org: connections are pooled and
+# concurrent calls multiplex over a single TLS session.
+_TG_BASE = f"https://api.telegram.org/bot{BOT_TOKEN}"
+_TG_ASYNC: httpx.AsyncClient = None
+
+async def tg_api(method: str, data: dict):
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN not set")
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/{method}"
-    resp = requests.post(url, json=data, timeout=15)
+    resp = await _TG_ASYNC.post("/" + method, json=data)
     try:
         resp.raise_for_status()
     except Exception:
@@ -132,36 +166,39 @@ def tg_api(method: str, data: dict):
         raise
     return resp.json()
 
-def create_invite_and_send(user_id: int, plan: str):
+async def create_invite_and_send(user_id: int, plan: str):
     links = {}
     try:
-        if plan in ("vip", "both") and VIP_CHANNEL_ID:
-            payload = {
-                "chat_id": VIP_CHANNEL_ID,
-                "member_limit": 1,
-                "name": f"user_{user_id}_vip",
-                "creates_join_request": False
-            }
-            r = tg_api("createChatInviteLink", payload)
-            link = r.get("result", {}).get("invite_link")
-            if link:
-                links["vip"] = link
-
-        if plan in ("dark", "both") and DARK_CHANNEL_ID:
-            payload = {
-                "chat_id": DARK_CHANNEL_ID,
-                "member_limit": 1,
-                "name": f"user_{user_id}_dark",
-                "creates_join_request": False
-            }
-            r = tg_api("createChatInviteLink", payload)
+        wanted = []
+        if plan in _PLANS_VIP and VIP_CHANNEL_ID:
+            wanted.append(("vip", VIP_CHANNEL_ID))
+        if plan in _PLANS_DARK and DARK_CHANNEL_ID:
+            wanted.append(("dark", DARK_CHANNEL_ID))
+
+        # both invite creations go out concurrently (multiplexed on HTTP/2)
+        results = await asyncio.gather(
+            *(
+                tg_api("createChatInviteLink", {
+                    "chat_id": chat_id,
+                    "member_limit": 1,
+                    "name": f"user_{user_id}_{tier}",
+                    "creates_join_request": False
+                })
+                for tier, chat_id in wanted
+            ),
+            return_exceptions=True,
+        )
+        for (tier, _), r in zip(wanted, results):
+            if isinstance(r, Exception):
+                logger.error("createChatInviteLink failed for %s: %s", tier, r)
+                continue
             link = r.get("result", {}).get("invite_link")
             if link:
-                links["dark"] = link
+                links[tier] = link
 
         if links:
-            SENT_INVITES.setdefault(user_id, {}).update(links)
-            save_state()
+            SENT_INVITES.setdefault(str(user_id), {}).update(links)
+            _DIRTY.set()
             lines = []
             if "vip" in links:
                 lines.append(f"🔑 VIP Channel:\n{links['vip']}")
@@ -169,7 +206,7 @@ def create_invite_and_send(user_id: int, plan: str):
                 lines.append(f"🕶 Dark Channel:\n{links['dark']}")
             text = "✅ Payment confirmed — here are your access links:\n\n" + "\n\n".join(lines)
             try:
-                tg_api("sendMessage", {"chat_id": user_id, "text": text})
+                await tg_api("sendMessage", {"chat_id": user_id, "text": text})
             except Exception:
                 logger.exception("Failed to send invite message to user")
     except Exception:
@@ -179,46 +216,67 @@ def create_invite_and_send(user_id: int, plan: str):
 # FastAPI app & webhook
 app = FastAPI()
 
-def verify_razorpay_signature(body_bytes: bytes, signature: str, secret: str) -> bool:
+# bound memory per connection: reject anything bigger than a sane webhook
+_MAX_BODY_BYTES = 1 << 20
+
+def verify_razorpay_signature(computed: bytes, signature: str,
+                              _b64decode=base64.b64decode, _compare=hmac.compare_digest) -> bool:
     """
     Razorpay X-Razorpay-Signature is base64(hmac_sha256(body, secret)).
+    Compares the raw computed digest against the header value.
+
+    _b64decode/_compare are bound at definition time (stdlib-style micro-opt)
+    so the hot path does no module attribute lookups.
     """
-    if not secret:
-        logger.warning("RAZORPAY_WEBHOOK_SECRET not set; rejecting webhooks")
+    # base64 of a 32-byte digest is always 44 chars; signature length is not
+    # secret, so garbage can be rejected without decoding
+    if len(signature) != 44:
         return False
     try:
-        computed = hmac.new(secret.encode("utf-8"), body_bytes, hashlib.sha256).digest()
-        expected_sig = base64.b64encode(computed).decode("utf-8")
-        return hmac.compare_digest(expected_sig, signature)
+        # decode the fixed-length header once and compare 32 raw bytes instead
+        # of base64-encoding the computed digest on every request
+        sig_bytes = _b64decode(signature, validate=True)
+        if len(sig_bytes) != 32:
+            # digest length is not secret; reject before the compare
+            return False
+        return _compare(computed, sig_bytes)
     except Exception:
         logger.exception("Error verifying signature")
         return False
 
 @app.post("/razorpay_webhook")
-async def razorpay_webhook(request: Request):
-    raw = await request.body()
+async def razorpay_webhook(request: Request, background_tasks: BackgroundTasks):
     signature = request.headers.get("X-Razorpay-Signature", "")
     if not signature:
         raise HTTPException(status_code=400, detail="Missing signature")
-    if not verify_razorpay_signature(raw, signature, RAZORPAY_WEBHOOK_SECRET):
+    if _HMAC_PROTO is None:
+        logger.warning("RAZORPAY_WEBHOOK_SECRET not set; rejecting webhooks")
+        raise HTTPException(status_code=403, detail="Invalid signature")
+
+    # stream the body into the keyed HMAC as it arrives: hashing overlaps the
+    # network receive and peak memory stays bounded instead of buffering the
+    # whole request before hashing it
+    h = _HMAC_PROTO.copy()
+    buf = bytearray()
+    async for chunk in request.stream():
+        h.update(chunk)
+        buf.extend(chunk)
+        if len(buf) > _MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail="Payload too large")
+
+    if not verify_razorpay_signature(h.digest(), signature):
         logger.warning("Invalid signature for webhook")
         raise HTTPException(status_code=403, detail="Invalid signature")
 
-    payload = await request.json()
+    payload = orjson.loads(bytes(buf))
     event = payload.get("event", "")
     logger.info("Webhook received: event=%s", event)
 
-    # find notes (Razorpay payload shapes vary)
-    notes = {}
+    # find notes (Razorpay payload shapes vary: payment vs payment_link)
     try:
-        if payload.get("payload", {}).get("payment", {}):
-            ent = payload["payload"]["payment"]["entity"]
-            notes = ent.get("notes", {}) or {}
-        elif payload.get("payload", {}).get("payment_link", {}):
-            ent = payload["payload"]["payment_link"]["entity"]
-            notes = ent.get("notes", {}) or {}
-        else:
-            notes = payload.get("payload", {}).get("payment", {}).get("entity", {}).get("notes", {}) or {}
+        pl = payload.get("payload") or {}
+        ent = (pl.get("payment") or pl.get("payment_link") or {}).get("entity") or {}
+        notes = ent.get("notes") or {}
     except Exception:
         notes = {}
 
@@ -235,48 +293,56 @@ async def razorpay_webhook(request: Request):
         logger.exception("Error parsing notes")
 
     # Accept captured/paid events
-    if event in ("payment.captured", "payment.authorized", "payment.link.paid", "payment.paid"):
-        rec = {
-            "time": now_ist().isoformat(),
-            "razorpay_event": event,
-            "notes": notes,
-        }
-        if tg_id:
-            rec["user_id"] = tg_id
-            rec["plan"] = plan
-        PURCHASE_LOG.append(rec)
-        save_state()
+    if event in _ACCEPTED_EVENTS:
+        _purchase_append(
+            time=now_ist().isoformat(),
+            razorpay_event=event,
+            notes=notes,
+            user_id=tg_id or None,
+            plan=plan if tg_id else None,
+        )
+        # Respond immediately; the autosave loop persists the dirty state and
+        # invites run after the response so the event loop isn't blocked on
+        # Telegram round-trips or disk I/O.
+        _DIRTY.set()
         if tg_id and plan:
-            try:
-                create_invite_and_send(tg_id, plan)
-                logger.info("Delivered invites to %s", tg_id)
-            except Exception:
-                logger.exception("Failed to deliver invites")
+            background_tasks.add_task(create_invite_and_send, tg_id, plan)
         return PlainTextResponse("ok")
     else:
         logger.info("Ignoring event %s", event)
         return PlainTextResponse("ignored")
 
-# Autosave thread (persist state every 60s)
-def _autosave_loop():
+# Autosave task (persist dirty state every 60s). Runs on the FastAPI event
+# loop instead of a dedicated thread; the actual disk write is pushed to a
+# worker via asyncio.to_thread so the loop stays responsive.
+_autosave_started = False
+
+async def _autosave_async():
+    while True:
+        await asyncio.sleep(60)
+        try:
+            if _DIRTY.is_set():
+                _DIRTY.clear()
+                await asyncio.to_thread(save_state)
+        except Exception:
+            logger.exception("Autosave failed")
+
+# Try to run bot.py (if present). This is optional: if bot.py is not available, webhook still works.
+async def _stream_bot_output(reader):
+    # forward the child's stdout to our logger so bot logs show up in Render
     try:
-        while True:
-            time.sleep(60)
-            try:
-                save_state()
-            except Exception:
-                logger.exception("Autosave failed")
+        async for raw_line in reader:
+            line = raw_line.decode("utf-8", "replace").rstrip()
+            if line:
+                logger.info("[bot] %s", line)
     except Exception:
-        logger.exception("Autosave thread stopped")
+        logger.exception("Error streaming bot child output")
 
-autosave_thr = threading.Thread(target=_autosave_loop, daemon=True)
-autosave_thr.start()
-
-# Try to import and run bot.py (if present). This is optional: if bot.py is not available, webhook still works.
-def start_bot_in_background():
+async def start_bot_in_background():
     """
     Start bot.py as a separate process. This avoids asyncio event-loop-in-thread errors.
-    Child stdout/stderr are streamed to the main logger so you can view bot logs in Render.
+    Uses an asyncio subprocess so the log forwarder shares the FastAPI loop
+    instead of occupying a reader thread.
     """
     try:
         bot_path = Path("bot.py")
@@ -288,26 +354,13 @@ def start_bot_in_background():
         cmd = [py, str(bot_path)]
         logger.info("Spawning bot process: %s", " ".join(shlex.quote(p) for p in cmd))
 
-        # Start the process; keep pipes so we can capture output
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=os.environ)
-
-        # Stream child's stdout to our logger (daemon thread)
-        def _stream_child_output(p):
-            try:
-                if p.stdout is None:
-                    return
-                for raw_line in iter(p.stdout.readline, b""):
-                    try:
-                        line = raw_line.decode("utf-8", "replace").rstrip()
-                        if line:
-                            logger.info("[bot] %s", line)
-                    except Exception:
-                        pass
-            except Exception:
-                logger.exception("Error streaming bot child output")
-
-        t = threading.Thread(target=_stream_child_output, args=(proc,), daemon=True)
-        t.start()
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=os.environ,
+        )
+        asyncio.create_task(_stream_bot_output(proc.stdout))
 
     except Exception:
         logger.exception("Could not spawn bot.py process")
@@ -315,8 +368,14 @@ def start_bot_in_background():
 # FastAPI startup event — load state and kick bot
 @app.on_event("startup")
 async def on_startup():
+    global _TG_ASYNC, _autosave_started
+    _TG_ASYNC = httpx.AsyncClient(base_url=_TG_BASE, http2=True, timeout=15)
     load_state()
-    start_bot_in_background()
+    # guard so reloads / repeated startup events never stack autosave tasks
+    if not _autosave_started:
+        _autosave_started = True
+        asyncio.create_task(_autosave_async())
+    await start_bot_in_background()
     logger.info("Webhook service started; bot background start attempted (if bot.py present).")
 
 # lightweight health endpoint
@@ -1,8 +1,8 @@
 # bot.py
 import os
+import gzip
 import json
-import tempfile
-import shutil
+import itertools
 import logging
 import threading
 import time
@@ -10,13 +10,18 @@ import base64
 
 import requests
 
+try:
+    import orjson
+except ImportError:  # keep stdlib json as a fallback if orjson is unavailable
+    orjson = None
 
 import asyncio
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -77,9 +82,15 @@ def create_payment_link(amount_paise, tg_id, plan):
     return r.json()
 
 
-# persistence path
+# persistence path. Snapshots are gzip-compressed (indent-2 JSON of a growing
+# log compresses >10x, cutting bytes written per flush); the uncompressed
+# path is still read once for migration from older deployments.
 DATA_DIR = os.getenv("DATA_DIR", "/data")
-DATA_FILE = os.path.join(DATA_DIR, "paymentbot.json")
+DATA_FILE = os.path.join(DATA_DIR, "paymentbot.json.gz")
+_LEGACY_DATA_FILE = os.path.join(DATA_DIR, "paymentbot.json")
+# append-only sidecar for newly seen user ids (one per line); merged into
+# known_users at load and reset whenever a full snapshot is written
+USERS_FILE = os.path.join(DATA_DIR, "users.ndjson")
 
 # timezone
 IST = timezone(timedelta(hours=5, minutes=30))
@@ -94,11 +105,55 @@ PLAN_LABELS = {"vip": "VIP Channel", "dark": "Dark Channel", "both": "VIP + Dark
 
 # runtime state
 PENDING_PAYMENTS: Dict[str, Dict[str, Any]] = {}
-PURCHASE_LOG: list = []
+# purchase log in struct-of-arrays form: one parallel list per field instead
+# of a dict per purchase (~232 bytes of overhead each). Appends are a few
+# list appends, scans iterate contiguous lists, and snapshots emit the
+# columns directly. Same column set and on-disk layout as app.py.
+_PLOG_COLUMNS = ("time", "razorpay_event", "user_id", "username", "plan", "method", "amount", "currency", "notes")
+PURCHASE_LOG: Dict[str, list] = {c: [] for c in _PLOG_COLUMNS}
 KNOWN_USERS: set = set()
 SENT_INVITES: dict = {}
 CONFIG: dict = {}
 
+# secondary index over PURCHASE_LOG: user_id -> set of purchased plans.
+# Kept in sync on insert and rebuilt on load so join-request admission is a
+# dict lookup instead of a scan of the whole log.
+USER_PLANS: Dict[int, set] = {}
+
+# daily income buckets: ISO date -> {"INR": ..., "USD": ..., "count": ...}.
+# Updated on approval and persisted, so /income sums a handful of day buckets
+# instead of re-scanning (and re-parsing timestamps of) the whole log.
+INCOME_BY_DAY: Dict[str, Dict[str, float]] = {}
+
+# set when in-memory state has mutated; the autosave loop coalesces bursts of
+# mutations into a single debounced write instead of one full snapshot per
+# button press
+_DIRTY = threading.Event()
+# set to cut the save worker's debounce short (urgent flushes: admin edits,
+# shutdown); _SHUTDOWN ends the worker loop without waiting out the interval
+_WAKE = threading.Event()
+_SHUTDOWN = threading.Event()
+# save_state is called from the flush worker and from main()'s shutdown path;
+# this lock keeps the fixed scratch file single-writer between the two
+_SAVE_LOCK = threading.Lock()
+# monotonically bumped on every mutation; save_state compares it against the
+# last-saved revision so an already-persisted state is never re-encoded
+# (e.g. the unconditional shutdown flush after a quiet period)
+_STATE_REV = 0
+_SAVED_REV = 0  # state as loaded from disk is, by definition, already saved
+
+def _mark_dirty(urgent: bool = False):
+    global _STATE_REV
+    _STATE_REV += 1
+    _DIRTY.set()
+    if urgent:
+        _WAKE.set()
+
+# payment-id generator: seeded with the startup time in milliseconds so ids
+# stay unique across restarts, then just increments — no per-request time
+# syscalls or string concatenation, and no same-second collisions
+_PID_COUNTER = itertools.count(int(time.time() * 1000))
+
 # ---- helpers ----
 def now_ist() -> datetime:
     return datetime.now(IST)
@@ -112,37 +167,80 @@ def _ensure_data_dir():
     except Exception:
         logger.exception("Could not ensure data dir")
 
+def _json_default(value):
+    # only used on the stdlib-json fallback path; orjson emits datetimes natively
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _dumps(payload: dict) -> bytes:
+    if orjson is not None:
+        # OPT_NON_STR_KEYS: int-keyed dicts (SENT_INVITES) serialize directly
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, indent=2, default=_json_default).encode("utf-8")
+
+def _loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def _purchase_append(**fields):
+    for c in _PLOG_COLUMNS:
+        PURCHASE_LOG[c].append(fields.get(c))
+
 def _serialize_state() -> dict:
+    # purchase_log is columnar with ISO timestamp strings, so it passes
+    # through as column-list references with no per-row work
     return {
         "pending_payments": PENDING_PAYMENTS,
-        "purchase_log": [
-            {**{k: (v.isoformat() if isinstance(v, datetime) else v) for k,v in p.items()}}
-            for p in PURCHASE_LOG
-        ],
+        "purchase_log": PURCHASE_LOG,
         "known_users": list(KNOWN_USERS),
-        "sent_invites": {str(k): v for k,v in SENT_INVITES.items()},
+        "sent_invites": SENT_INVITES,
         "config": CONFIG,
+        "income_by_day": INCOME_BY_DAY,
     }
 
+def _record_income(day: str, amount, currency: str):
+    bucket = INCOME_BY_DAY.setdefault(day, {"INR": 0, "USD": 0, "count": 0})
+    bucket["count"] = bucket.get("count", 0) + 1
+    if currency:
+        bucket[currency] = bucket.get(currency, 0) + (amount or 0)
+
 def _deserialize_state(data: dict):
-    global PENDING_PAYMENTS, PURCHASE_LOG, KNOWN_USERS, SENT_INVITES, CONFIG
+    global PENDING_PAYMENTS, PURCHASE_LOG, KNOWN_USERS, SENT_INVITES, CONFIG, USER_PLANS, INCOME_BY_DAY
     if not data:
         return
     PENDING_PAYMENTS = data.get("pending_payments", {}) or {}
-    PURCHASE_LOG = []
-    for p in data.get("purchase_log", []) or []:
-        p_copy = dict(p)
-        t = p_copy.get("time")
-        if isinstance(t, str):
-            try:
-                p_copy["time"] = datetime.fromisoformat(t)
-            except Exception:
-                pass
-        PURCHASE_LOG.append(p_copy)
+    raw_log = data.get("purchase_log", []) or []
+    PURCHASE_LOG = {c: [] for c in _PLOG_COLUMNS}
+    if isinstance(raw_log, dict):
+        # columnar snapshot: adopt the column lists, padding short or missing
+        # columns so all stay the same length
+        n = max((len(v) for v in raw_log.values()), default=0)
+        for c in _PLOG_COLUMNS:
+            col = list(raw_log.get(c) or [])
+            col.extend([None] * (n - len(col)))
+            PURCHASE_LOG[c] = col
+    else:
+        # legacy row-oriented snapshot: expand once at load
+        for p in raw_log:
+            _purchase_append(**p)
+    USER_PLANS = {}
+    for uid, plan in zip(PURCHASE_LOG["user_id"], PURCHASE_LOG["plan"]):
+        if uid is not None:
+            USER_PLANS.setdefault(uid, set()).add(plan)
+    INCOME_BY_DAY = data.get("income_by_day", {}) or {}
+    if not INCOME_BY_DAY:
+        # older snapshots have no aggregate; rebuild it in one columnar pass
+        for t, amount, currency in zip(PURCHASE_LOG["time"], PURCHASE_LOG["amount"], PURCHASE_LOG["currency"]):
+            if isinstance(t, str):
+                _record_income(t[:10], amount, currency)
     KNOWN_USERS = set(data.get("known_users", []) or [])
+    # JSON text keys come back as str; convert once here at load — saves now
+    # pass the int-keyed dict straight through to the serializer
     sent = data.get("sent_invites", {}) or {}
     new_sent = {}
-    for k,v in sent.items():
+    for k, v in sent.items():
         try:
             new_sent[int(k)] = v
         except Exception:
@@ -150,29 +248,109 @@ def _deserialize_state(data: dict):
     SENT_INVITES = new_sent
     CONFIG = data.get("config", {}) or {}
 
+def _append_known_user(uid: int):
+    # a bare /start only costs one appended line instead of a full snapshot
+    try:
+        _ensure_data_dir()
+        with open(USERS_FILE, "ab") as f:
+            f.write(b"%d\n" % uid)
+    except Exception:
+        logger.exception("Could not append to users sidecar")
+
 def save_state():
+    global _SAVED_REV
+    # the lock serializes the flush worker against the shutdown-path call in
+    # main(): thr.join() there has a timeout, so both can otherwise write the
+    # fixed scratch file at once and publish interleaved (corrupt) bytes
+    with _SAVE_LOCK:
+        rev = _STATE_REV
+        if rev == _SAVED_REV:
+            return
+        _save_state_locked(rev)
+
+def _save_state_locked(rev):
+    global _SAVED_REV
     try:
         _ensure_data_dir()
+        # reset the sidecar first: ids recorded there are already in
+        # KNOWN_USERS, so the snapshot below covers them (appends racing in
+        # after this point survive in the sidecar; duplicates are harmless)
+        try:
+            open(USERS_FILE, "wb").close()
+        except Exception:
+            logger.exception("Could not reset users sidecar")
         payload = _serialize_state()
-        fd, tmp = tempfile.mkstemp(dir=DATA_DIR)
-        with os.fdopen(fd, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-        shutil.move(tmp, DATA_FILE)
+        # single-writer under _SAVE_LOCK, so a fixed scratch path is safe and
+        # skips mkstemp's random-name/O_EXCL retry dance on every save
+        tmp = DATA_FILE + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            # compresslevel=3: most of the ratio at a fraction of the CPU cost
+            os.write(fd, gzip.compress(_dumps(payload), compresslevel=3))
+            # flush file data to disk before the rename so a crash can never
+            # expose a truncated snapshot behind a "successful" replace
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, DATA_FILE)
+        if hasattr(os, "O_DIRECTORY"):
+            # persist the rename itself (directory entry) as well
+            dfd = os.open(DATA_DIR, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dfd)
+            finally:
+                os.close(dfd)
+        _SAVED_REV = rev
         logger.info("State saved to %s", DATA_FILE)
     except Exception:
         logger.exception("Failed to save state")
 
+# single-writer flush worker: async handlers only ever set _DIRTY (a plain
+# Event, no syscalls); this daemon thread is the one place that serializes
+# and hits the filesystem, so the polling loop never blocks on disk I/O
+def _save_worker():
+    try:
+        while not _SHUTDOWN.is_set():
+            _DIRTY.wait()
+            # debounce, but let urgent flushes (or shutdown) wake us early
+            _WAKE.wait(timeout=5)
+            _WAKE.clear()
+            try:
+                if _DIRTY.is_set():
+                    _DIRTY.clear()
+                    save_state()
+            except Exception:
+                logger.exception("Autosave failed")
+    except Exception:
+        logger.exception("Save worker stopped")
+
 def load_state():
     try:
-        if not os.path.exists(DATA_FILE):
+        path = DATA_FILE if os.path.exists(DATA_FILE) else _LEGACY_DATA_FILE
+        if not os.path.exists(path):
             logger.info("No data file found at %s — starting fresh", DATA_FILE)
             return
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        # read raw bytes: orjson parses buffers directly (and stdlib json
+        # accepts bytes too), so no whole-file UTF-8 decode into a str first
+        with open(path, "rb") as f:
+            blob = f.read()
+        if blob[:2] == b"\x1f\x8b":
+            blob = gzip.decompress(blob)
+        data = _loads(blob)
         _deserialize_state(data)
-        logger.info("Loaded state from %s", DATA_FILE)
+        logger.info("Loaded state from %s", path)
     except Exception:
         logger.exception("Failed to load state")
+    # merge users recorded since the last full snapshot
+    try:
+        if os.path.exists(USERS_FILE):
+            with open(USERS_FILE, "rb") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        KNOWN_USERS.add(int(line))
+    except Exception:
+        logger.exception("Failed to merge users sidecar")
 
 # ---- invite creation & delivery ----
 async def create_and_store_invites(context: ContextTypes.DEFAULT_TYPE, user_id: int, plan: str, require_join_request: bool = True):
@@ -188,7 +366,7 @@ async def create_and_store_invites(context: ContextTypes.DEFAULT_TYPE, user_id:
                     name=f"user_{user_id}_vip"
                 )
                 user_links["vip"] = vip_obj.invite_link
-                save_state()
+                _mark_dirty()
             created["vip"] = user_links.get("vip")
         if plan in ("dark", "both") and DARK_CHANNEL_ID:
             if "dark" not in user_links:
@@ -199,7 +377,7 @@ async def create_and_store_invites(context: ContextTypes.DEFAULT_TYPE, user_id:
                     name=f"user_{user_id}_dark"
                 )
                 user_links["dark"] = dark_obj.invite_link
-                save_state()
+                _mark_dirty()
             created["dark"] = user_links.get("dark")
     except Exception:
         logger.exception("Error creating invite links")
@@ -217,16 +395,101 @@ async def send_invites_to_user(context: ContextTypes.DEFAULT_TYPE, user_id: int,
         return True
     return False
 
+# ---- payment instruction templates ----
+# Constant payment config (UPI id, crypto address, Remitly info, guide links)
+# is baked into the templates once; per-click calls only fill label, amount
+# and deadline instead of rebuilding the whole message from f-strings.
+_TPL_UPI = None
+_TPL_CRYPTO = None
+_TPL_REMITLY = None
+_QR_CAPTION = ""
+
+def _rebuild_templates():
+    global _TPL_UPI, _TPL_CRYPTO, _TPL_REMITLY, _QR_CAPTION
+
+    def esc(value):
+        # admin-settable values may contain braces (e.g. /set_remitly with
+        # "{John Doe}"); escape them so the bound .format below substitutes
+        # only the {label}/{amount}/{deadline} placeholders
+        return str(value).replace("{", "{{").replace("}", "}}")
+
+    _TPL_UPI = (
+        "🧾 *UPI Payment Instructions*\n\n"
+        "Plan: *{label}*\n"
+        "Amount: *₹{amount}*\n\n"
+        f"UPI ID: `{esc(UPI_ID)}`\n\n"
+        "1️⃣ Open any UPI app (GPay, PhonePe, Paytm, etc.)\n"
+        "2️⃣ Choose *Scan & Pay* or *Pay UPI ID*\n"
+        "3️⃣ Either scan the QR image below or pay directly to the UPI ID above.\n"
+        "4️⃣ Enter the amount shown above and confirm.\n\n"
+        f"If you're confused, see this guide: {esc(UPI_HOW_TO_PAY_LINK)}\n\n"
+        "⏳ Time limit: until *{deadline}*\n\n"
+        "After payment send screenshot/photo here plus optional UTR."
+    ).format
+    _TPL_CRYPTO = (
+        "🪙 *Crypto Payment Instructions*\n\n"
+        "Plan: *{label}*\n"
+        "Amount: *${amount}*\n\n"
+        f"Network: `{esc(CRYPTO_NETWORK)}`\n"
+        f"Address: `{esc(CRYPTO_ADDRESS)}`\n\n"
+        "⏳ Time limit: until *{deadline}*\n\n"
+        "After payment send screenshot/photo + TXID here."
+    ).format
+    _TPL_REMITLY = (
+        "🌍 *Remitly Payment Instructions*\n\n"
+        "Plan: *{label}*\n"
+        "Amount: *₹{amount}*\n\n"
+        f"Extra info: {esc(REMITLY_INFO)}\n\n"
+        "⏳ Time limit: until *{deadline}*\n\n"
+        "After payment send screenshot/photo here."
+    ).format
+    _QR_CAPTION = f"📷 Scan this QR to pay.\nUPI ID: `{UPI_ID}`"
+
+_rebuild_templates()
+
+def _apply_config():
+    """Apply persisted CONFIG overrides to the module-level settings."""
+    global VIP_CHANNEL_ID, DARK_CHANNEL_ID, UPI_ID, CRYPTO_ADDRESS, REMITLY_INFO
+    channels = CONFIG.get("channels") or {}
+    payment = CONFIG.get("payment") or {}
+    if channels.get("vip"):
+        try:
+            VIP_CHANNEL_ID = int(channels["vip"])
+        except Exception:
+            pass
+    if channels.get("dark"):
+        try:
+            DARK_CHANNEL_ID = int(channels["dark"])
+        except Exception:
+            pass
+    if payment.get("upi_id"):
+        UPI_ID = payment["upi_id"]
+    if payment.get("crypto_address"):
+        CRYPTO_ADDRESS = payment["crypto_address"]
+    if payment.get("remitly_info"):
+        REMITLY_INFO = payment["remitly_info"]
+    # overrides may have changed the constants baked into the templates
+    # and the flattened price cache
+    _rebuild_templates()
+    _rebuild_price_cache()
+
+# flat (plan, method) -> (amount, currency) lookup built from PRICE_CONFIG
+# merged with persisted overrides; rebuilt only when prices actually change
+# so the button handlers pay one dict hit instead of chained fallbacks
+_PRICE_CACHE: Dict[Tuple[str, str], Tuple[Any, str]] = {}
+
+def _rebuild_price_cache():
+    cfg = {**PRICE_CONFIG, **(CONFIG.get("price_config") or {})}
+    _PRICE_CACHE.clear()
+    for plan, plan_cfg in cfg.items():
+        _PRICE_CACHE[(plan, "upi")] = (plan_cfg.get("upi_inr"), "INR")
+        _PRICE_CACHE[(plan, "crypto")] = (plan_cfg.get("crypto_usd"), "USD")
+        _PRICE_CACHE[(plan, "remitly")] = (plan_cfg.get("remit_inr"), "INR")
+
+_rebuild_price_cache()
+
 def get_price(plan: str, method: str):
-    cfg = CONFIG.get("price_config", PRICE_CONFIG)
-    plan_cfg = cfg.get(plan, PRICE_CONFIG.get(plan, {}))
-    if method == "upi":
-        return plan_cfg.get("upi_inr"), "INR"
-    if method == "crypto":
-        return plan_cfg.get("crypto_usd"), "USD"
-    if method == "remitly":
-        return plan_cfg.get("remit_inr"), "INR"
-    return None, ""
+    return _PRICE_CACHE.get((plan, method), (None, ""))
 
 # ---- handlers ----
 async def handle_chat_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -240,18 +503,13 @@ async def handle_chat_join_request(update: Update, context: ContextTypes.DEFAULT
     logger.info("Join request from %s (%s) for chat %s", requester.username, user_id, chat_id)
 
     def user_has_access_for_chat(uid: int, chat_id: int) -> bool:
-        for p in PURCHASE_LOG:
-            try:
-                if p.get("user_id") == uid:
-                    plan = p.get("plan")
-                    if plan == "vip" and chat_id == VIP_CHANNEL_ID:
-                        return True
-                    if plan == "dark" and chat_id == DARK_CHANNEL_ID:
-                        return True
-                    if plan == "both" and chat_id in (VIP_CHANNEL_ID, DARK_CHANNEL_ID):
-                        return True
-            except Exception:
-                continue
+        plans = USER_PLANS.get(uid, ())
+        if "both" in plans and chat_id in (VIP_CHANNEL_ID, DARK_CHANNEL_ID):
+            return True
+        if "vip" in plans and chat_id == VIP_CHANNEL_ID:
+            return True
+        if "dark" in plans and chat_id == DARK_CHANNEL_ID:
+            return True
         return False
 
     allowed = user_has_access_for_chat(user_id, chat_id)
@@ -275,8 +533,9 @@ async def handle_chat_join_request(update: Update, context: ContextTypes.DEFAULT
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    KNOWN_USERS.add(user.id)
-    save_state()
+    if user.id not in KNOWN_USERS:
+        KNOWN_USERS.add(user.id)
+        _append_known_user(user.id)
     keyboard = [
         [InlineKeyboardButton("💎 VIP Channel (₹499)", callback_data="plan_vip")],
         [InlineKeyboardButton("🕶 Dark Channel (₹1999)", callback_data="plan_dark")],
@@ -390,43 +649,16 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             if not payment_url:
                 # fallback: show manual UPI instructions (existing text + QR)
-                msg = (
-                    "🧾 *UPI Payment Instructions*\n\n"
-                    f"Plan: *{label}*\n"
-                    f"Amount: *₹{amount}*\n\n"
-                    f"UPI ID: `{UPI_ID}`\n\n"
-                    "1️⃣ Open any UPI app (GPay, PhonePe, Paytm, etc.)\n"
-                    "2️⃣ Choose *Scan & Pay* or *Pay UPI ID*\n"
-                    "3️⃣ Either scan the QR image below or pay directly to the UPI ID above.\n"
-                    "4️⃣ Enter the amount shown above and confirm.\n\n"
-                    f"If you're confused, see this guide: {UPI_HOW_TO_PAY_LINK}\n\n"
-                    f"⏳ Time limit: until *{deadline_str}*\n\n"
-                    "After payment send screenshot/photo here plus optional UTR."
-                )
+                msg = _TPL_UPI(label=label, amount=amount, deadline=deadline_str)
                 await query.message.reply_text(msg, parse_mode="Markdown")
                 if UPI_QR_URL:
-                    await query.message.reply_photo(photo=UPI_QR_URL, caption=f"📷 Scan this QR to pay.\nUPI ID: `{UPI_ID}`", parse_mode="Markdown")
+                    await query.message.reply_photo(photo=UPI_QR_URL, caption=_QR_CAPTION, parse_mode="Markdown")
 
         elif method == "crypto":
-            msg = (
-                "🪙 *Crypto Payment Instructions*\n\n"
-                f"Plan: *{label}*\n"
-                f"Amount: *${amount}*\n\n"
-                f"Network: `{CRYPTO_NETWORK}`\n"
-                f"Address: `{CRYPTO_ADDRESS}`\n\n"
-                f"⏳ Time limit: until *{deadline_str}*\n\n"
-                "After payment send screenshot/photo + TXID here."
-            )
+            msg = _TPL_CRYPTO(label=label, amount=amount, deadline=deadline_str)
             await query.message.reply_text(msg, parse_mode="Markdown")
         else:
-            msg = (
-                "🌍 *Remitly Payment Instructions*\n\n"
-                f"Plan: *{label}*\n"
-                f"Amount: *₹{amount}*\n\n"
-                f"Extra info: {REMITLY_INFO}\n\n"
-                f"⏳ Time limit: until *{deadline_str}*\n\n"
-                "After payment send screenshot/photo here."
-            )
+            msg = _TPL_REMITLY(label=label, amount=amount, deadline=deadline_str)
             await query.message.reply_text(msg, parse_mode="Markdown")
         return
 
@@ -449,16 +681,18 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
         username = payment.get("username", "")
 
         if action == "approve":
-            PURCHASE_LOG.append({
-                "time": now_ist(),
-                "user_id": user_id,
-                "username": username,
-                "plan": plan,
-                "method": method,
-                "amount": amount,
-                "currency": currency,
-            })
-            save_state()
+            _purchase_append(
+                time=now_ist().isoformat(),
+                user_id=user_id,
+                username=username,
+                plan=plan,
+                method=method,
+                amount=amount,
+                currency=currency,
+            )
+            USER_PLANS.setdefault(user_id, set()).add(plan)
+            _record_income(now_ist().date().isoformat(), amount, currency)
+            _mark_dirty()
             links = await create_and_store_invites(context, user_id, plan, require_join_request=True)
             kb = [
                 [
@@ -471,7 +705,7 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
             payment["invite_created"] = True
             payment["invite_links"] = links
             PENDING_PAYMENTS[payment_id] = payment
-            save_state()
+            _mark_dirty()
             return
 
         if action == "sendlink":
@@ -480,7 +714,7 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await query.message.reply_text(f"✅ Invite sent to user {user_id}.")
                 payment["invite_sent"] = True
                 PENDING_PAYMENTS.pop(payment_id, None)
-                save_state()
+                _mark_dirty()
             else:
                 await query.message.reply_text("⚠️ No invite links available for this user; try re-creating them.")
             return
@@ -492,7 +726,7 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.exception("Can't send decline message")
             await query.message.reply_text(f"❌ Declined payment (ID: {payment_id})")
             PENDING_PAYMENTS.pop(payment_id, None)
-            save_state()
+            _mark_dirty()
             return
 
 async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -506,7 +740,7 @@ async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     amount, currency = get_price(plan, method)
-    payment_id = str(message.message_id) + "_" + str(int(datetime.now().timestamp()))
+    payment_id = str(next(_PID_COUNTER))
     PENDING_PAYMENTS[payment_id] = {
         "user_id": user.id,
         "username": user.username or "",
@@ -515,7 +749,7 @@ async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
         "amount": amount,
         "currency": currency,
     }
-    save_state()
+    _mark_dirty()
 
     try:
         await context.bot.forward_message(chat_id=ADMIN_CHAT_ID, from_chat_id=chat.id, message_id=message.message_id)
@@ -526,6 +760,25 @@ async def handle_payment_proof(update: Update, context: ContextTypes.DEFAULT_TYP
     await context.bot.send_message(chat_id=ADMIN_CHAT_ID, text=(f"💰 New payment request\nFrom: @{user.username or 'NoUsername'} (ID: {user.id})\nPlan: {PLAN_LABELS.get(plan, plan)}\nMethod: {method.upper()}\nAmount: {amount} {currency}\nPayment ID: {payment_id}\n\nCheck forwarded message and choose:"), reply_markup=InlineKeyboardMarkup(kb))
     await message.reply_text("✅ Payment proof received. We'll verify and send access after approval.")
 
+class _WaitingProofFilter(filters.MessageFilter):
+    """
+    Matches only when the sender has a pending payment-proof context, so the
+    warn handler's coroutine isn't created (and user_data isn't resolved
+    through PTB dispatch) for every unrelated text message on a busy bot.
+    """
+
+    def __init__(self):
+        super().__init__(name="waiting_proof")
+        self.app = None  # set in main() once the Application exists
+
+    def filter(self, message):
+        if self.app is None or message.from_user is None:
+            return False
+        ud = self.app.user_data.get(message.from_user.id) or {}
+        return bool(ud.get("waiting_for_proof") and ud.get("selected_plan"))
+
+_WAITING_PROOF = _WaitingProofFilter()
+
 async def warn_text_not_allowed(update: Update, context: ContextTypes.DEFAULT_TYPE):
     method = context.user_data.get("waiting_for_proof")
     plan = context.user_data.get("selected_plan")
@@ -545,7 +798,7 @@ async def set_vip_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         VIP_CHANNEL_ID = int(context.args[0])
         CONFIG.setdefault("channels", {})["vip"] = VIP_CHANNEL_ID
-        save_state()
+        _mark_dirty(urgent=True)  # persist admin edits immediately
         await update.message.reply_text(f"VIP_CHANNEL_ID updated to {VIP_CHANNEL_ID}")
     except ValueError:
         await update.message.reply_text("channel_id must be an integer (e.g. -1001234567890)")
@@ -561,7 +814,7 @@ async def set_dark_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         DARK_CHANNEL_ID = int(context.args[0])
         CONFIG.setdefault("channels", {})["dark"] = DARK_CHANNEL_ID
-        save_state()
+        _mark_dirty(urgent=True)  # persist admin edits immediately
         await update.message.reply_text(f"DARK_CHANNEL_ID updated to {DARK_CHANNEL_ID}")
     except ValueError:
         await update.message.reply_text("channel_id must be an integer (e.g. -1009876543210)")
@@ -574,14 +827,30 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /broadcast your message text\n\nThis will send the text to all users who started the bot.")
         return
     text = " ".join(context.args)
-    sent = 0
-    failed = 0
-    for uid in KNOWN_USERS:
-        try:
-            await context.bot.send_message(chat_id=uid, text=text)
-            sent += 1
-        except Exception:
-            failed += 1
+    # up to 25 sends in flight at once; each slot holds its semaphore for
+    # 25/30 s after sending, so the 25 slots together release at most
+    # ~30 msg/s — Telegram's global limit
+    sem = asyncio.Semaphore(25)
+
+    async def _send_one(uid: int) -> bool:
+        async with sem:
+            try:
+                try:
+                    await context.bot.send_message(chat_id=uid, text=text)
+                except RetryAfter as exc:
+                    # we tripped the flood limit anyway; wait it out and
+                    # retry once before counting the user as failed
+                    await asyncio.sleep(exc.retry_after + 1)
+                    await context.bot.send_message(chat_id=uid, text=text)
+                return True
+            except Exception:
+                return False
+            finally:
+                await asyncio.sleep(25 / 30)
+
+    results = await asyncio.gather(*(_send_one(uid) for uid in KNOWN_USERS))
+    sent = sum(results)
+    failed = len(results) - sent
     await update.message.reply_text(f"Broadcast done.\n✅ Sent: {sent}\n❌ Failed: {failed}")
 
 async def income(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -607,19 +876,16 @@ async def income(update: Update, context: ContextTypes.DEFAULT_TYPE):
     total_inr = 0
     total_usd = 0
     count = 0
-    for p in PURCHASE_LOG:
-        t = p.get("time")
-        if isinstance(t, str):
-            try:
-                t = datetime.fromisoformat(t)
-            except Exception:
-                continue
-        if start <= t < end:
-            count += 1
-            if p.get("currency") == "INR":
-                total_inr += p.get("amount") or 0
-            elif p.get("currency") == "USD":
-                total_usd += p.get("amount") or 0
+    # sum pre-aggregated day buckets over the window (end is exclusive)
+    day = start.date()
+    last_day = (end - timedelta(microseconds=1)).date()
+    while day <= last_day:
+        bucket = INCOME_BY_DAY.get(day.isoformat())
+        if bucket:
+            count += bucket.get("count", 0)
+            total_inr += bucket.get("INR", 0)
+            total_usd += bucket.get("USD", 0)
+        day += timedelta(days=1)
     msg = (f"📊 *Income Insights – {label}*\n\n"
            f"Total orders: *{count}*\n"
            f"INR collected: *₹{total_inr}*\n"
@@ -655,7 +921,8 @@ async def set_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
         plan_cfg["remit_inr"] = amount
     cfg[plan] = plan_cfg
     CONFIG["price_config"] = cfg
-    save_state()
+    _rebuild_price_cache()
+    _mark_dirty(urgent=True)  # persist admin edits immediately
     await update.message.reply_text(f"Updated price for {PLAN_LABELS.get(plan, plan)} [{method}] to {amount}.")
 
 async def set_upi(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -668,7 +935,8 @@ async def set_upi(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     UPI_ID = context.args[0]
     CONFIG.setdefault("payment", {})["upi_id"] = UPI_ID
-    save_state()
+    _rebuild_templates()
+    _mark_dirty(urgent=True)  # persist admin edits immediately
     await update.message.reply_text(f"UPI ID updated to: {UPI_ID}")
 
 async def set_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -681,7 +949,8 @@ async def set_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     CRYPTO_ADDRESS = context.args[0]
     CONFIG.setdefault("payment", {})["crypto_address"] = CRYPTO_ADDRESS
-    save_state()
+    _rebuild_templates()
+    _mark_dirty(urgent=True)  # persist admin edits immediately
     await update.message.reply_text(f"Crypto address updated to: {CRYPTO_ADDRESS}")
 
 async def set_remitly(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -694,7 +963,8 @@ async def set_remitly(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     REMITLY_INFO = " ".join(context.args)
     CONFIG.setdefault("payment", {})["remitly_info"] = REMITLY_INFO
-    save_state()
+    _rebuild_templates()
+    _mark_dirty(urgent=True)  # persist admin edits immediately
     await update.message.reply_text(f"Remitly info updated to:\n{REMITLY_INFO}")
 
 # ---- main() (called by app.py from a background thread) ----
@@ -706,23 +976,7 @@ def main():
     # load persisted state (so the bot has latest PURCHASE_LOG / SENT_INVITES)
     load_state()
 
-    global VIP_CHANNEL_ID, DARK_CHANNEL_ID, UPI_ID, CRYPTO_ADDRESS, REMITLY_INFO
-    if CONFIG.get("channels", {}).get("vip"):
-        try:
-            VIP_CHANNEL_ID = int(CONFIG["channels"]["vip"])
-        except Exception:
-            pass
-    if CONFIG.get("channels", {}).get("dark"):
-        try:
-            DARK_CHANNEL_ID = int(CONFIG["channels"]["dark"])
-        except Exception:
-            pass
-    if CONFIG.get("payment", {}).get("upi_id"):
-        UPI_ID = CONFIG["payment"]["upi_id"]
-    if CONFIG.get("payment", {}).get("crypto_address"):
-        CRYPTO_ADDRESS = CONFIG["payment"]["crypto_address"]
-    if CONFIG.get("payment", {}).get("remitly_info"):
-        REMITLY_INFO = CONFIG["payment"]["remitly_info"]
+    _apply_config()
 
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN missing")
@@ -735,7 +989,8 @@ def main():
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(handle_buttons))
     app.add_handler(MessageHandler((filters.PHOTO | filters.Document.ALL) & ~filters.COMMAND, handle_payment_proof))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, warn_text_not_allowed))
+    _WAITING_PROOF.app = app
+    app.add_handler(MessageHandler(_WAITING_PROOF & filters.TEXT & ~filters.COMMAND, warn_text_not_allowed))
 
     app.add_handler(CommandHandler("broadcast", broadcast))
     app.add_handler(CommandHandler("income", income))
@@ -748,19 +1003,8 @@ def main():
 
     app.add_handler(ChatJoinRequestHandler(handle_chat_join_request))
 
-    # autosave background thread (daemon)
-    def _autosave_loop():
-        try:
-            while True:
-                time.sleep(60)
-                try:
-                    save_state()
-                except Exception:
-                    logger.exception("Autosave failed")
-        except Exception:
-            logger.exception("Autosave thread stopped")
-
-    thr = threading.Thread(target=_autosave_loop, daemon=True)
+    # start the single-writer save worker (daemon)
+    thr = threading.Thread(target=_save_worker, daemon=True)
     thr.start()
 
     # When main() is run inside a non-main thread we must ensure an asyncio loop exists for that thread.
@@ -772,7 +1016,15 @@ def main():
 
     logger.info("Bot starting (polling)...")
     # This will block until stopped
-    app.run_polling()
+    try:
+        app.run_polling()
+    finally:
+        # stop the worker promptly, then flush anything it hadn't written yet
+        _SHUTDOWN.set()
+        _mark_dirty()
+        _WAKE.set()
+        thr.join(timeout=2)
+        save_state()
 if __name__ == "__main__":
     main()
 